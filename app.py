@@ -1,13 +1,31 @@
+import io
 import os
+import re
 import json
-import base64
+import copy
+import time
+import queue
+import hashlib
+import functools
 import mimetypes
-from datetime import date, datetime, timedelta, timezone
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import date, datetime, timedelta
 
+import orjson
+import pybase64
 import requests
-from flask import Flask, request, jsonify, render_template, send_from_directory, session
-from google.oauth2 import id_token
-from google.auth.transport import requests as grequests
+from cachetools import TTLCache
+from flask import (
+    Flask,
+    Response,
+    request,
+    jsonify,
+    render_template,
+    send_from_directory,
+    session,
+    stream_with_context,
+)
 from sqlalchemy import DateTime, ForeignKey, Integer, JSON, String, create_engine, text
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Mapped, declarative_base, mapped_column, relationship, sessionmaker
@@ -23,10 +41,48 @@ app.config["SESSION_COOKIE_SECURE"] = os.environ.get("FLASK_ENV") != "developmen
 app.config["PERMANENT_SESSION_LIFETIME"] = timedelta(hours=12)
 
 GOOGLE_CLIENT_ID = os.environ.get("GOOGLE_CLIENT_ID")
+# Model names are fixed for the life of the process.
+OPENAI_MODEL = os.environ.get("OPENAI_MODEL", "gpt-4.1-mini")
+MISTRAL_MODEL = os.environ.get("MISTRAL_MODEL", "mistral-small-latest")
 MOBILE_API_BASE_URL = os.environ.get(
     "MOBILE_API_BASE_URL", "https://api.nutritiontracker.fr/api"
 ).rstrip("/")
 
+# Verified Google ID token payloads keyed by the SHA-256 of the raw token, so
+# raw credentials never sit in memory. Entries are also bounded by each token's
+# own ``exp`` claim on lookup.
+GOOGLE_TOKEN_CACHE_TTL_SECONDS = 300
+_google_token_cache = TTLCache(maxsize=10_000, ttl=GOOGLE_TOKEN_CACHE_TTL_SECONDS)
+_google_token_cache_lock = threading.Lock()
+
+# Caps in-flight AI provider calls per process so a burst of requests served by
+# gunicorn's worker threads cannot exceed the provider's rate limits.
+AI_MAX_CONCURRENCY = int(os.environ.get("AI_MAX_CONCURRENCY", "16"))
+_ai_request_slots = threading.BoundedSemaphore(AI_MAX_CONCURRENCY)
+
+# One pooled HTTP session for AI provider calls, so concurrent requests reuse
+# keep-alive TLS connections instead of opening one per call.
+_ai_http = requests.Session()
+_ai_http.mount(
+    "https://",
+    requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=max(AI_MAX_CONCURRENCY, 32)),
+)
+
+# Model output for meal analyses, keyed by SHA-256 of (lang, text, image digest).
+# Entries hold the parsed JSON without user_id/datetime_utc, which are stamped
+# per request on a hit.
+MEAL_ANALYSIS_CACHE_TTL_SECONDS = 3600
+_meal_analysis_cache = TTLCache(maxsize=2048, ttl=MEAL_ANALYSIS_CACHE_TTL_SECONDS)
+_meal_analysis_cache_lock = threading.Lock()
+
+# Shared pool for fanning out independent blocking I/O within one request.
+_io_executor = ThreadPoolExecutor(max_workers=64, thread_name_prefix="io")
+
+# Optional micro-batching of /api/recommendations: requests arriving within the
+# window are answered by a single model call. Disabled when the window is 0.
+RECOMMENDATION_BATCH_WINDOW_MS = int(os.environ.get("RECOMMENDATION_BATCH_WINDOW_MS", "0"))
+RECOMMENDATION_BATCH_MAX_SIZE = int(os.environ.get("RECOMMENDATION_BATCH_MAX_SIZE", "8"))
+
 client = None
 db_engine = None
 DbSessionLocal = None
@@ -67,6 +123,21 @@ class RecommendationRecord(Base):
     user: Mapped[User] = relationship(back_populates="recommendations")
 
 
+def meal_analysis_cache_key(lang: str, text: str, image_digest: str = "") -> str:
+    return hashlib.sha256(f"{lang}\0{text}\0{image_digest}".encode("utf-8")).hexdigest()
+
+
+def get_cached_meal_analysis(cache_key: str) -> dict | None:
+    with _meal_analysis_cache_lock:
+        cached = _meal_analysis_cache.get(cache_key)
+    return copy.deepcopy(cached) if cached is not None else None
+
+
+def cache_meal_analysis(cache_key: str, parsed: dict) -> None:
+    with _meal_analysis_cache_lock:
+        _meal_analysis_cache[cache_key] = copy.deepcopy(parsed)
+
+
 def get_missing_env_vars() -> list[str]:
     missing = []
     if not os.environ.get("MISTRAL_API_KEY") and not os.environ.get("OPENAI_API_KEY"):
@@ -200,7 +271,7 @@ def get_ai_provider() -> dict | None:
         return {
             "provider": "mistral",
             "api_key": os.environ.get("MISTRAL_API_KEY"),
-            "model": os.environ.get("MISTRAL_MODEL", "mistral-small-latest"),
+            "model": MISTRAL_MODEL,
             "base_url": "https://api.mistral.ai/v1/chat/completions",
         }
 
@@ -208,14 +279,14 @@ def get_ai_provider() -> dict | None:
         return {
             "provider": "openai",
             "api_key": os.environ.get("OPENAI_API_KEY"),
-            "model": os.environ.get("OPENAI_MODEL", "gpt-4.1-mini"),
+            "model": OPENAI_MODEL,
             "base_url": "https://api.openai.com/v1/chat/completions",
         }
 
     return None
 
 
-def call_ai_provider(provider: dict, messages: list[dict], temperature: float) -> str:
+def build_ai_request(provider: dict, messages: list[dict], temperature: float) -> tuple[dict, dict]:
     headers = {
         "Content-Type": "application/json",
         "Authorization": f"Bearer {provider['api_key']}",
@@ -226,13 +297,52 @@ def call_ai_provider(provider: dict, messages: list[dict], temperature: float) -
         "temperature": temperature,
         "response_format": {"type": "json_object"},
     }
+    return headers, payload
 
-    response = requests.post(provider["base_url"], headers=headers, json=payload, timeout=90)
+
+def call_ai_provider(provider: dict, messages: list[dict], temperature: float) -> str:
+    headers, payload = build_ai_request(provider, messages, temperature)
+
+    with _ai_request_slots:
+        response = _ai_http.post(provider["base_url"], headers=headers, json=payload, timeout=90)
     response.raise_for_status()
     data = response.json()
     return data["choices"][0]["message"]["content"] or ""
 
 
+def stream_ai_provider(provider: dict, messages: list[dict], temperature: float):
+    """Yield content deltas from an OpenAI-compatible streaming completion."""
+    headers, payload = build_ai_request(provider, messages, temperature)
+    payload["stream"] = True
+
+    with _ai_request_slots:
+        with _ai_http.post(
+            provider["base_url"], headers=headers, json=payload, timeout=90, stream=True
+        ) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line.startswith(b"data:"):
+                    continue
+                data = line[5:].strip()
+                if data == b"[DONE]":
+                    break
+                choices = orjson.loads(data).get("choices") or []
+                delta = (choices[0].get("delta") or {}).get("content") if choices else None
+                if delta:
+                    yield delta
+
+
+def get_fallback_provider() -> dict | None:
+    if not os.environ.get("OPENAI_API_KEY"):
+        return None
+    return {
+        "provider": "openai",
+        "api_key": os.environ.get("OPENAI_API_KEY"),
+        "model": OPENAI_MODEL,
+        "base_url": "https://api.openai.com/v1/chat/completions",
+    }
+
+
 def invoke_ai(messages: list[dict], temperature: float) -> str:
     provider = get_ai_provider()
     if provider is None:
@@ -242,14 +352,7 @@ def invoke_ai(messages: list[dict], temperature: float) -> str:
         try:
             return call_ai_provider(provider, messages, temperature)
         except Exception:
-            fallback_provider = None
-            if os.environ.get("OPENAI_API_KEY"):
-                fallback_provider = {
-                    "provider": "openai",
-                    "api_key": os.environ.get("OPENAI_API_KEY"),
-                    "model": os.environ.get("OPENAI_MODEL", "gpt-4.1-mini"),
-                    "base_url": "https://api.openai.com/v1/chat/completions",
-                }
+            fallback_provider = get_fallback_provider()
             if fallback_provider is None:
                 raise
             return call_ai_provider(fallback_provider, messages, temperature)
@@ -257,8 +360,131 @@ def invoke_ai(messages: list[dict], temperature: float) -> str:
     return call_ai_provider(provider, messages, temperature)
 
 
+def stream_ai(messages: list[dict], temperature: float):
+    """Streaming counterpart of invoke_ai. Falls back to OpenAI only when
+    Mistral fails before sending anything, so clients never see mixed output."""
+    provider = get_ai_provider()
+    if provider is None:
+        raise RuntimeError("no_ai_provider_configured")
+
+    if provider["provider"] == "mistral":
+        started = False
+        try:
+            for delta in stream_ai_provider(provider, messages, temperature):
+                started = True
+                yield delta
+            return
+        except Exception:
+            fallback_provider = get_fallback_provider()
+            if started or fallback_provider is None:
+                raise
+        yield from stream_ai_provider(fallback_provider, messages, temperature)
+        return
+
+    yield from stream_ai_provider(provider, messages, temperature)
+
+
+# Multiple of 3 so each chunk encodes to base64 without padding.
+IMAGE_ENCODE_CHUNK_BYTES = 57 * 1024
+
+
+def encode_image_data_url(stream, mime: str, hasher=None) -> str:
+    """Build a ``data:`` URL from a file-like object, base64-encoding it chunk
+    by chunk straight into one buffer that already holds the URL prefix, so
+    neither the raw upload nor a separate base64 string is materialized.
+
+    When ``hasher`` (a hashlib object) is given, it is fed the same chunks in
+    the same pass, so the image is read only once for both.
+    """
+    encoded = bytearray(f"data:{mime};base64,".encode("ascii"))
+    pending = b""
+    while True:
+        chunk = stream.read(IMAGE_ENCODE_CHUNK_BYTES)
+        if not chunk:
+            break
+        if hasher is not None:
+            hasher.update(chunk)
+        chunk = pending + chunk
+        cut = len(chunk) - len(chunk) % 3
+        encoded += pybase64.b64encode(chunk[:cut])
+        pending = chunk[cut:]
+    encoded += pybase64.b64encode(pending)
+    return encoded.decode("ascii")
+
+
+# Uploads outside these limits are rejected before anything is read or encoded.
+ALLOWED_IMAGE_MIMES = {"image/jpeg", "image/png", "image/webp"}
+MAX_IMAGE_BYTES = 4 * 1024 * 1024
+
+
+def get_upload_size(image_file) -> int:
+    """Size of an uploaded file, measured by seeking rather than reading it."""
+    stream = image_file.stream
+    position = stream.tell()
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(position)
+    return size
+
+
+# Vision models downsample large photos anyway; anything bigger than this is
+# re-encoded before upload to save bandwidth, image tokens and latency.
+IMAGE_DOWNSCALE_MIN_BYTES = 512 * 1024
+IMAGE_MAX_SIDE = 1536
+IMAGE_JPEG_QUALITY = 85
+# Small files can declare huge dimensions (e.g. a solid-colour PNG); such
+# images are forwarded as-is rather than decoded.
+IMAGE_MAX_DECODE_PIXELS = 40_000_000
+
+
+def maybe_downscale_image(stream, mime: str) -> tuple:
+    """Return the (stream, mime) to send to the model.
+
+    Images under both limits are passed through untouched; only oversized
+    ones are decoded once, shrunk to IMAGE_MAX_SIDE and re-encoded as JPEG.
+    """
+    try:
+        from PIL import Image, ImageOps
+    except Exception:
+        return stream, mime
+
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    try:
+        # Image.open only parses the header, so small images cost no decode.
+        with Image.open(stream) as image:
+            if size <= IMAGE_DOWNSCALE_MIN_BYTES and max(image.size) <= IMAGE_MAX_SIDE:
+                stream.seek(0)
+                return stream, mime
+            if image.width * image.height > IMAGE_MAX_DECODE_PIXELS:
+                stream.seek(0)
+                return stream, mime
+            # Shrink before transposing: thumbnail() can then use the JPEG
+            # reduced-scale decode, and the rotation only copies the small image.
+            image.thumbnail((IMAGE_MAX_SIDE, IMAGE_MAX_SIDE), Image.BICUBIC)
+            resized = ImageOps.exif_transpose(image)
+            if resized.mode not in ("RGB", "L"):
+                resized = resized.convert("RGB")
+            output = io.BytesIO()
+            resized.save(output, format="JPEG", quality=IMAGE_JPEG_QUALITY, optimize=False)
+    except Exception:
+        stream.seek(0)
+        return stream, mime
+
+    if output.tell() >= size:
+        stream.seek(0)
+        return stream, mime
+    output.seek(0)
+    return output, "image/jpeg"
+
+
 def utc_now_iso() -> str:
-    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+    seconds, micros = divmod(time.time_ns() // 1000, 1_000_000)
+    tm = time.gmtime(seconds)
+    return "%04d-%02d-%02dT%02d:%02d:%02d.%06dZ" % (
+        tm.tm_year, tm.tm_mon, tm.tm_mday, tm.tm_hour, tm.tm_min, tm.tm_sec, micros
+    )
 
 
 def get_bearer_token() -> str | None:
@@ -268,17 +494,39 @@ def get_bearer_token() -> str | None:
     return None
 
 
+@functools.lru_cache(maxsize=1)
+def get_google_auth():
+    """Import google-auth on first use, keeping it off the cold-start path.
+
+    Returns the ``id_token`` module and one shared transport, so keep-alive
+    connections are reused across certificate fetches.
+    """
+    from google.oauth2 import id_token
+    from google.auth.transport import requests as grequests
+
+    return id_token, grequests.Request()
+
+
 def verify_google_id_token(token: str) -> dict:
     """Validate Google ID token and return its payload (includes sub, email, name...)."""
     google_client_id = os.environ.get("GOOGLE_CLIENT_ID")
     if not google_client_id:
         raise RuntimeError("missing_google_client_id")
 
+    cache_key = hashlib.sha256(f"{google_client_id}\0{token}".encode("utf-8")).hexdigest()
+    with _google_token_cache_lock:
+        cached = _google_token_cache.get(cache_key)
+    if cached is not None and cached.get("exp", 0) > time.time() + 5:
+        return dict(cached)
+
+    id_token, google_request = get_google_auth()
     payload = id_token.verify_oauth2_token(
         token,
-        grequests.Request(),
+        google_request,
         google_client_id,
     )
+    with _google_token_cache_lock:
+        _google_token_cache[cache_key] = dict(payload)
     return payload
 
 
@@ -324,13 +572,67 @@ def authenticate_request() -> tuple[dict | None, tuple | None]:
         return None, (jsonify({"error": "invalid_access_token"}), 401)
 
 
+# Models occasionally wrap JSON in a markdown code fence despite the prompt.
+_JSON_FENCE = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$")
+
+
 def safe_json_loads(s: str):
     try:
-        return json.loads(s)
+        return orjson.loads(s)
+    except Exception:
+        pass
+    try:
+        return orjson.loads(_JSON_FENCE.sub("", s))
     except Exception:
         return None
 
 
+def json_response(payload: dict) -> Response:
+    """Serialize a model response body with orjson instead of jsonify."""
+    return Response(orjson.dumps(payload), mimetype="application/json")
+
+
+def wants_event_stream() -> bool:
+    return request.accept_mimetypes.best_match(
+        ["application/json", "text/event-stream"]
+    ) == "text/event-stream"
+
+
+def sse_event(event: str, payload) -> bytes:
+    return b"event: " + event.encode("ascii") + b"\ndata: " + orjson.dumps(payload) + b"\n\n"
+
+
+def stream_model_response(build_messages, temperature: float, finalize) -> Response:
+    """Forward model deltas to the client as server-sent events, then send the
+    parsed and finalized JSON as a ``done`` event (or an ``error`` event).
+
+    ``build_messages`` is called inside the stream, so failures while
+    preparing the prompt are also reported as an ``error`` event.
+    """
+
+    def generate():
+        chunks = []
+        try:
+            for delta in stream_ai(build_messages(), temperature):
+                chunks.append(delta)
+                yield b"data: " + orjson.dumps(delta) + b"\n\n"
+        except Exception:
+            yield sse_event("error", {"error": "model_request_failed"})
+            return
+        raw = "".join(chunks)
+        parsed = safe_json_loads(raw)
+        if not isinstance(parsed, dict):
+            yield sse_event("error", {"error": "model_returned_invalid_json", "raw": raw})
+            return
+        yield sse_event("done", finalize(parsed))
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 def mobile_api_request(method: str, path: str, **kwargs):
     return requests.request(
         method,
@@ -401,8 +703,7 @@ Schema obrigatório (JSON):
 """.strip()
 
 
-def build_user_prompt(text: str, lang: str) -> str:
-    return f"""
+USER_PROMPT_TEMPLATE = """
 Idioma de saída: {lang}
 Descrição do usuário: {text}
 
@@ -414,6 +715,10 @@ Regras:
 """.strip()
 
 
+def build_user_prompt(text: str, lang: str) -> str:
+    return USER_PROMPT_TEMPLATE.format(lang=lang, text=text)
+
+
 SYSTEM_PROMPT_RECO = """
 Você é um coach nutricional (não médico).
 Responda APENAS em JSON válido. Sem diagnóstico. Sem alarmismo.
@@ -438,6 +743,127 @@ Schema obrigatório:
 }
 """.strip()
 
+SYSTEM_PROMPT_RECO_BATCH = (
+    SYSTEM_PROMPT_RECO
+    + """
+
+Você receberá vários pedidos independentes em "requests".
+Responda com {"results": [...]}, contendo um objeto no schema acima para cada
+pedido, na mesma ordem dos pedidos.
+"""
+).strip()
+
+
+# Constant leading messages, built once and shared by every request.
+ANALYZE_SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT_ANALYZE}
+RECO_SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT_RECO}
+RECO_BATCH_SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT_RECO_BATCH}
+
+
+def build_recommendation_messages(payload: dict) -> list[dict]:
+    return [
+        RECO_SYSTEM_MESSAGE,
+        # Client-supplied JSON: stdlib json, since orjson rejects integers beyond 64 bits.
+        {"role": "user", "content": json.dumps(payload, ensure_ascii=False)},
+    ]
+
+
+def generate_recommendation(payload: dict) -> tuple[dict | None, str]:
+    """Ask the model for one payload's recommendations; returns (parsed, raw)."""
+    raw = invoke_ai(build_recommendation_messages(payload), temperature=0.4)
+    return safe_json_loads(raw), raw
+
+
+def generate_recommendation_batch(payloads: list[dict]) -> list[tuple[dict | None, str]]:
+    """Answer several payloads with one model call, splitting the batch in half
+    and retrying whenever the model's results cannot be matched to the inputs."""
+    if len(payloads) == 1:
+        return [generate_recommendation(payloads[0])]
+
+    raw = invoke_ai(
+        [
+            RECO_BATCH_SYSTEM_MESSAGE,
+            {"role": "user", "content": json.dumps({"requests": payloads}, ensure_ascii=False)},
+        ],
+        temperature=0.4,
+    )
+    parsed = safe_json_loads(raw)
+    results = parsed.get("results") if isinstance(parsed, dict) else None
+    if (
+        isinstance(results, list)
+        and len(results) == len(payloads)
+        and all(isinstance(result, dict) for result in results)
+    ):
+        return [(result, raw) for result in results]
+
+    middle = len(payloads) // 2
+    return generate_recommendation_batch(payloads[:middle]) + generate_recommendation_batch(
+        payloads[middle:]
+    )
+
+
+class RecommendationBatcher:
+    """Collects concurrent recommendation payloads for up to ``window_seconds``
+    (or ``max_size`` payloads) and resolves each caller's future from one
+    batched model call."""
+
+    def __init__(self, window_seconds: float, max_size: int):
+        self.window_seconds = window_seconds
+        self.max_size = max_size
+        self._queue: queue.Queue = queue.Queue()
+        self._dispatcher = ThreadPoolExecutor(
+            max_workers=AI_MAX_CONCURRENCY, thread_name_prefix="recommendation-batch"
+        )
+        self._collector = None
+        self._lock = threading.Lock()
+
+    def submit(self, payload: dict) -> Future:
+        future = Future()
+        self._queue.put((payload, future))
+        # Started lazily so gunicorn workers forked after import each get their own.
+        with self._lock:
+            if self._collector is None or not self._collector.is_alive():
+                self._collector = threading.Thread(
+                    target=self._collect, name="recommendation-batcher", daemon=True
+                )
+                self._collector.start()
+        return future
+
+    def _collect(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window_seconds
+            while len(batch) < self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._dispatcher.submit(self._resolve, batch)
+
+    def _resolve(self, batch: list[tuple[dict, Future]]) -> None:
+        try:
+            results = generate_recommendation_batch([payload for payload, _ in batch])
+        except Exception as error:
+            for _, future in batch:
+                future.set_exception(error)
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+
+_recommendation_batcher = RecommendationBatcher(
+    RECOMMENDATION_BATCH_WINDOW_MS / 1000, RECOMMENDATION_BATCH_MAX_SIZE
+)
+
+
+def request_recommendation(payload: dict) -> tuple[dict | None, str]:
+    if RECOMMENDATION_BATCH_WINDOW_MS <= 0:
+        return generate_recommendation(payload)
+    return _recommendation_batcher.submit(payload).result()
+
 
 @app.get("/")
 def index():
@@ -539,24 +965,6 @@ def browser_account_dashboard():
     today = date.today()
     headers = {"X-User-Id": user_id}
 
-    try:
-        meals_response = mobile_api_request(
-            "GET",
-            "/meals",
-            headers=headers,
-            params={
-                "from": (today - timedelta(days=days)).isoformat(),
-                "to": today.isoformat(),
-                "includePhoto": "true",
-            },
-        )
-        meals_response.raise_for_status()
-        meals = meals_response.json()
-        if not isinstance(meals, list):
-            meals = []
-    except Exception:
-        return jsonify({"error": "mobile_dashboard_unavailable"}), 502
-
     optional_requests = {
         "goals": ("/goals", None),
         "water": ("/water-intake", {"day": today.isoformat()}),
@@ -567,9 +975,36 @@ def browser_account_dashboard():
         "water": {"day_key_utc": today.isoformat(), "liters": 0},
         "points": {"balance": 0},
     }
-    for key, (path, params) in optional_requests.items():
+
+    # The mobile API calls are independent, so they run concurrently.
+    meals_future = _io_executor.submit(
+        mobile_api_request,
+        "GET",
+        "/meals",
+        headers=headers,
+        params={
+            "from": (today - timedelta(days=days)).isoformat(),
+            "to": today.isoformat(),
+            "includePhoto": "true",
+        },
+    )
+    extra_futures = {
+        key: _io_executor.submit(mobile_api_request, "GET", path, headers=headers, params=params)
+        for key, (path, params) in optional_requests.items()
+    }
+
+    try:
+        meals_response = meals_future.result()
+        meals_response.raise_for_status()
+        meals = meals_response.json()
+        if not isinstance(meals, list):
+            meals = []
+    except Exception:
+        return jsonify({"error": "mobile_dashboard_unavailable"}), 502
+
+    for key, future in extra_futures.items():
         try:
-            response = mobile_api_request("GET", path, headers=headers, params=params)
+            response = future.result()
             response.raise_for_status()
             payload = response.json()
             if isinstance(payload, dict):
@@ -610,256 +1045,266 @@ def impact_page():
     return render_template("legal.html", page_type="impact")
 
 
-@app.get("/api/openapi.json")
-def openapi_spec():
-    return jsonify({
-        "openapi": "3.0.3",
-        "info": {
-            "title": "NutriTracker API",
-            "version": "1.0.0",
-            "description": "Nutrition analysis and recommendation API",
-        },
-        "servers": [{"url": "/", "description": "Current server"}],
-        "tags": [
-            {"name": "System"},
-            {"name": "Account"},
-            {"name": "Nutrition"},
-        ],
-        "components": {
-            "securitySchemes": {
-                "bearerAuth": {
-                    "type": "http",
-                    "scheme": "bearer",
-                    "bearerFormat": "JWT",
-                    "description": "Google ID token or registered-mobile access token: Bearer <token>",
-                }
+OPENAPI_SPEC = {
+    "openapi": "3.0.3",
+    "info": {
+        "title": "NutriTracker API",
+        "version": "1.0.0",
+        "description": "Nutrition analysis and recommendation API",
+    },
+    "servers": [{"url": "/", "description": "Current server"}],
+    "tags": [
+        {"name": "System"},
+        {"name": "Account"},
+        {"name": "Nutrition"},
+    ],
+    "components": {
+        "securitySchemes": {
+            "bearerAuth": {
+                "type": "http",
+                "scheme": "bearer",
+                "bearerFormat": "JWT",
+                "description": "Google ID token or registered-mobile access token: Bearer <token>",
             }
-        },
-        "paths": {
-            "/api/health": {
-                "get": {
-                    "tags": ["System"],
-                    "summary": "Health check",
-                    "responses": {
-                        "200": {
-                            "description": "Service health",
-                            "content": {
-                                "application/json": {
-                                    "example": {"ok": True}
-                                }
-                            },
-                        }
-                    },
-                }
-            },
-            "/api/health/db": {
-                "get": {
-                    "tags": ["System"],
-                    "summary": "Database connectivity health check",
-                    "responses": {
-                        "200": {
-                            "description": "Database reachable",
-                            "content": {
-                                "application/json": {
-                                    "example": {"ok": True, "database": "connected"}
-                                }
-                            },
+        }
+    },
+    "paths": {
+        "/api/health": {
+            "get": {
+                "tags": ["System"],
+                "summary": "Health check",
+                "responses": {
+                    "200": {
+                        "description": "Service health",
+                        "content": {
+                            "application/json": {
+                                "example": {"ok": True}
+                            }
                         },
-                        "503": {
-                            "description": "Database not configured or not reachable",
+                    }
+                },
+            }
+        },
+        "/api/health/db": {
+            "get": {
+                "tags": ["System"],
+                "summary": "Database connectivity health check",
+                "responses": {
+                    "200": {
+                        "description": "Database reachable",
+                        "content": {
+                            "application/json": {
+                                "example": {"ok": True, "database": "connected"}
+                            }
                         },
                     },
-                }
-            },
-            "/api/me": {
-                "get": {
-                    "tags": ["Account"],
-                    "summary": "Get the verified current account",
-                    "security": [{"bearerAuth": []}],
-                    "responses": {
-                        "200": {"description": "Minimal verified profile"},
-                        "401": {"description": "Missing or invalid access token"},
-                    },
-                }
-            },
-            "/api/account/email/login": {
-                "post": {
-                    "tags": ["Account"],
-                    "summary": "Sign in with the same email account as the mobile app",
-                    "requestBody": {
-                        "required": True,
-                        "content": {"application/json": {"example": {"email": "user@example.com", "password": "••••••••"}}},
-                    },
-                    "responses": {
-                        "200": {"description": "Secure browser session established"},
-                        "401": {"description": "Invalid mobile account credentials"},
-                    },
-                }
-            },
-            "/api/account/history": {
-                "get": {
-                    "tags": ["Account"],
-                    "summary": "Retrieve meals from the connected mobile account",
-                    "responses": {
-                        "200": {"description": "Mobile meal history"},
-                        "401": {"description": "Browser account session required"},
+                    "503": {
+                        "description": "Database not configured or not reachable",
                     },
-                }
-            },
-            "/api/account/dashboard": {
-                "get": {
-                    "tags": ["Account"],
-                    "summary": "Get mobile dashboard meals, goals, hydration, and points",
-                    "responses": {
-                        "200": {"description": "Combined mobile dashboard data"},
-                        "401": {"description": "Browser account session required"},
-                        "502": {"description": "Mobile dashboard service unavailable"},
-                    },
-                }
-            },
-            "/api/me/history": {
-                "get": {
-                    "tags": ["Account"],
-                    "summary": "Retrieve saved meals and recommendations",
-                    "security": [{"bearerAuth": []}],
-                    "parameters": [{
-                        "name": "limit", "in": "query", "required": False,
-                        "schema": {"type": "integer", "minimum": 1, "maximum": 100, "default": 20},
-                    }],
-                    "responses": {
-                        "200": {"description": "Account history, newest first"},
-                        "401": {"description": "Missing or invalid access token"},
-                        "503": {"description": "Database not configured"},
+                },
+            }
+        },
+        "/api/me": {
+            "get": {
+                "tags": ["Account"],
+                "summary": "Get the verified current account",
+                "security": [{"bearerAuth": []}],
+                "responses": {
+                    "200": {"description": "Minimal verified profile"},
+                    "401": {"description": "Missing or invalid access token"},
+                },
+            }
+        },
+        "/api/account/email/login": {
+            "post": {
+                "tags": ["Account"],
+                "summary": "Sign in with the same email account as the mobile app",
+                "requestBody": {
+                    "required": True,
+                    "content": {"application/json": {"example": {"email": "user@example.com", "password": "••••••••"}}},
+                },
+                "responses": {
+                    "200": {"description": "Secure browser session established"},
+                    "401": {"description": "Invalid mobile account credentials"},
+                },
+            }
+        },
+        "/api/account/history": {
+            "get": {
+                "tags": ["Account"],
+                "summary": "Retrieve meals from the connected mobile account",
+                "responses": {
+                    "200": {"description": "Mobile meal history"},
+                    "401": {"description": "Browser account session required"},
+                },
+            }
+        },
+        "/api/account/dashboard": {
+            "get": {
+                "tags": ["Account"],
+                "summary": "Get mobile dashboard meals, goals, hydration, and points",
+                "responses": {
+                    "200": {"description": "Combined mobile dashboard data"},
+                    "401": {"description": "Browser account session required"},
+                    "502": {"description": "Mobile dashboard service unavailable"},
+                },
+            }
+        },
+        "/api/me/history": {
+            "get": {
+                "tags": ["Account"],
+                "summary": "Retrieve saved meals and recommendations",
+                "security": [{"bearerAuth": []}],
+                "parameters": [{
+                    "name": "limit", "in": "query", "required": False,
+                    "schema": {"type": "integer", "minimum": 1, "maximum": 100, "default": 20},
+                }],
+                "responses": {
+                    "200": {"description": "Account history, newest first"},
+                    "401": {"description": "Missing or invalid access token"},
+                    "503": {"description": "Database not configured"},
+                },
+            }
+        },
+        "/api/analyze-meal": {
+            "post": {
+                "tags": ["Nutrition"],
+                "summary": "Analyze meal from text or image",
+                "security": [{"bearerAuth": []}],
+                "requestBody": {
+                    "required": True,
+                    "content": {
+                        "application/json": {
+                            "example": {
+                                "lang": "fr",
+                                "text": "2 oeufs + salade verte + 1 pomme"
+                            },
+                            "schema": {
+                                "type": "object",
+                                "properties": {
+                                    "lang": {"type": "string", "example": "fr"},
+                                    "text": {"type": "string", "example": "2 oeufs + salade"},
+                                }
+                            }
+                        }
                     },
-                }
-            },
-            "/api/analyze-meal": {
-                "post": {
-                    "tags": ["Nutrition"],
-                    "summary": "Analyze meal from text or image",
-                    "security": [{"bearerAuth": []}],
-                    "requestBody": {
-                        "required": True,
+                },
+                "responses": {
+                    "200": {
+                        "description": "Analysis result",
                         "content": {
                             "application/json": {
                                 "example": {
-                                    "lang": "fr",
-                                    "text": "2 oeufs + salade verte + 1 pomme"
-                                },
-                                "schema": {
-                                    "type": "object",
-                                    "properties": {
-                                        "lang": {"type": "string", "example": "fr"},
-                                        "text": {"type": "string", "example": "2 oeufs + salade"},
-                                    }
+                                    "schema_version": "1.0",
+                                    "meal": {
+                                        "language": "fr",
+                                        "items": [
+                                            {
+                                                "name": "oeufs",
+                                                "quantity": 2,
+                                                "unit": "unit",
+                                                "estimated_grams": 100,
+                                                "macros": {
+                                                    "calories": 156,
+                                                    "carbs_g": 1.1,
+                                                    "protein_g": 13.0
+                                                },
+                                                "confidence": 0.86
+                                            }
+                                        ],
+                                        "totals": {
+                                            "calories": 251,
+                                            "carbs_g": 18.5,
+                                            "protein_g": 14.2
+                                        },
+                                        "notes": "Estimation automatique",
+                                        "overall_confidence": 0.8
+                                    },
+                                    "user_id": "google_sub",
+                                    "datetime_utc": "2026-02-28T12:00:00Z"
                                 }
                             }
-                        },
+                        }
                     },
-                    "responses": {
-                        "200": {
-                            "description": "Analysis result",
-                            "content": {
-                                "application/json": {
-                                    "example": {
-                                        "schema_version": "1.0",
-                                        "meal": {
-                                            "language": "fr",
-                                            "items": [
-                                                {
-                                                    "name": "oeufs",
-                                                    "quantity": 2,
-                                                    "unit": "unit",
-                                                    "estimated_grams": 100,
-                                                    "macros": {
-                                                        "calories": 156,
-                                                        "carbs_g": 1.1,
-                                                        "protein_g": 13.0
-                                                    },
-                                                    "confidence": 0.86
-                                                }
-                                            ],
-                                            "totals": {
-                                                "calories": 251,
-                                                "carbs_g": 18.5,
-                                                "protein_g": 14.2
-                                            },
-                                            "notes": "Estimation automatique",
-                                            "overall_confidence": 0.8
-                                        },
-                                        "user_id": "google_sub",
-                                        "datetime_utc": "2026-02-28T12:00:00Z"
-                                    }
-                                }
+                    "400": {"description": "Bad request"},
+                    "401": {"description": "Missing or invalid bearer token"},
+                    "503": {"description": "Server not configured"},
+                },
+            }
+        },
+        "/api/recommendations": {
+            "post": {
+                "tags": ["Nutrition"],
+                "summary": "Generate personalized recommendations",
+                "security": [{"bearerAuth": []}],
+                "requestBody": {
+                    "required": True,
+                    "content": {
+                        "application/json": {
+                            "example": {
+                                "history": [
+                                    {"date": "2026-02-26", "calories": 2100, "carbs_g": 180, "protein_g": 105},
+                                    {"date": "2026-02-27", "calories": 1950, "carbs_g": 170, "protein_g": 110}
+                                ],
+                                "goal": "weight_loss"
+                            },
+                            "schema": {
+                                "type": "object",
+                                "additionalProperties": True,
                             }
-                        },
-                        "400": {"description": "Bad request"},
-                        "401": {"description": "Missing or invalid bearer token"},
-                        "503": {"description": "Server not configured"},
+                        }
                     },
-                }
-            },
-            "/api/recommendations": {
-                "post": {
-                    "tags": ["Nutrition"],
-                    "summary": "Generate personalized recommendations",
-                    "security": [{"bearerAuth": []}],
-                    "requestBody": {
-                        "required": True,
+                },
+                "responses": {
+                    "200": {
+                        "description": "Recommendations result",
                         "content": {
                             "application/json": {
                                 "example": {
-                                    "history": [
-                                        {"date": "2026-02-26", "calories": 2100, "carbs_g": 180, "protein_g": 105},
-                                        {"date": "2026-02-27", "calories": 1950, "carbs_g": 170, "protein_g": 110}
+                                    "schema_version": "1.0",
+                                    "recommendations": [
+                                        {
+                                            "title": "Increase protein at breakfast",
+                                            "why": "Helps satiety and muscle maintenance",
+                                            "actions": [
+                                                "Add 1 egg or greek yogurt",
+                                                "Target 20-30g protein at breakfast"
+                                            ]
+                                        }
                                     ],
-                                    "goal": "weight_loss"
-                                },
-                                "schema": {
-                                    "type": "object",
-                                    "additionalProperties": True,
-                                }
-                            }
-                        },
-                    },
-                    "responses": {
-                        "200": {
-                            "description": "Recommendations result",
-                            "content": {
-                                "application/json": {
-                                    "example": {
-                                        "schema_version": "1.0",
-                                        "recommendations": [
-                                            {
-                                                "title": "Increase protein at breakfast",
-                                                "why": "Helps satiety and muscle maintenance",
-                                                "actions": [
-                                                    "Add 1 egg or greek yogurt",
-                                                    "Target 20-30g protein at breakfast"
-                                                ]
-                                            }
-                                        ],
-                                        "insights": {
-                                            "avg_calories": 2025,
-                                            "avg_carbs_g": 175,
-                                            "avg_protein_g": 108
-                                        },
-                                        "warnings": [
-                                            "Estimates are not medical advice"
-                                        ],
-                                        "user_id": "google_sub",
-                                        "datetime_utc": "2026-02-28T12:00:00Z"
-                                    }
+                                    "insights": {
+                                        "avg_calories": 2025,
+                                        "avg_carbs_g": 175,
+                                        "avg_protein_g": 108
+                                    },
+                                    "warnings": [
+                                        "Estimates are not medical advice"
+                                    ],
+                                    "user_id": "google_sub",
+                                    "datetime_utc": "2026-02-28T12:00:00Z"
                                 }
                             }
-                        },
-                        "401": {"description": "Missing or invalid bearer token"},
-                        "503": {"description": "Server not configured"},
+                        }
                     },
-                }
-            },
+                    "401": {"description": "Missing or invalid bearer token"},
+                    "503": {"description": "Server not configured"},
+                },
+            }
         },
-    })
+    },
+}
+
+# The spec is static, so it is serialized once at import rather than per request.
+OPENAPI_JSON = orjson.dumps(OPENAPI_SPEC)
+
+
+@app.get("/api/openapi.json")
+def openapi_spec():
+    return Response(
+        OPENAPI_JSON,
+        mimetype="application/json",
+        headers={"Cache-Control": "public, max-age=3600"},
+    )
 
 
 @app.get("/api/docs")
@@ -967,24 +1412,58 @@ def analyze_meal():
         return jsonify({"error": "missing_text_or_image"}), 400
 
     user_content = [{"type": "text", "text": build_user_prompt(text, lang)}]
+    image_digest = ""
 
     if image_file:
-        img_bytes = image_file.read()
-        img_b64 = base64.b64encode(img_bytes).decode("utf-8")
-        mime = image_file.mimetype or "image/jpeg"
+        mime, _ = mimetypes.guess_type(image_file.filename or "")
+        mime = mime or image_file.mimetype or "image/jpeg"
+        if mime.lower() not in ALLOWED_IMAGE_MIMES:
+            return jsonify({"error": "unsupported_media_type"}), 415
+        # Measure the spooled upload; the part's Content-Length is client-controlled.
+        if get_upload_size(image_file) > MAX_IMAGE_BYTES:
+            return jsonify({"error": "image_too_large"}), 413
+        # Uploads are already compressed (JPEG/PNG/WebP): forward the original
+        # bytes as-is. Do not add decode/re-encode steps (e.g. PIL open().save())
+        # here; maybe_downscale_image is the only place allowed to re-encode,
+        # and only for oversized photos.
+        image_stream, mime = maybe_downscale_image(image_file.stream, mime)
+        image_hasher = hashlib.blake2b(digest_size=16)
         user_content.append({
             "type": "image_url",
-            "image_url": {"url": f"data:{mime};base64,{img_b64}"}
+            "image_url": {"url": encode_image_data_url(image_stream, mime, image_hasher)}
         })
+        image_digest = f"{mime}:{image_hasher.hexdigest()}"
+
+    messages = [
+        ANALYZE_SYSTEM_MESSAGE,
+        {"role": "user", "content": user_content},
+    ]
+
+    cache_key = meal_analysis_cache_key(lang, text, image_digest)
+    cached = get_cached_meal_analysis(cache_key)
+
+    def finalize(parsed: dict) -> dict:
+        parsed.setdefault("schema_version", "1.0")
+        if cached is None:
+            cache_meal_analysis(cache_key, parsed)
+        parsed["user_id"] = user_id
+        parsed["datetime_utc"] = utc_now_iso()
+        try:
+            save_meal_analysis(user_id, lang, parsed)
+        except SQLAlchemyError:
+            pass
+        return parsed
+
+    if cached is not None:
+        if wants_event_stream():
+            return Response(sse_event("done", finalize(cached)), mimetype="text/event-stream")
+        return json_response(finalize(cached))
+
+    if wants_event_stream():
+        return stream_model_response(lambda: messages, 0.2, finalize)
 
     try:
-        raw = invoke_ai(
-            [
-                {"role": "system", "content": SYSTEM_PROMPT_ANALYZE},
-                {"role": "user", "content": user_content},
-            ],
-            temperature=0.2,
-        )
+        raw = invoke_ai(messages, temperature=0.2)
     except Exception:
         # Provider names and transport details are intentionally kept internal.
         return jsonify({"error": "model_request_failed"}), 502
@@ -992,16 +1471,7 @@ def analyze_meal():
     if parsed is None:
         return jsonify({"error": "model_returned_invalid_json", "raw": raw}), 502
 
-    parsed.setdefault("schema_version", "1.0")
-    parsed["user_id"] = user_id
-    parsed["datetime_utc"] = utc_now_iso()
-
-    try:
-        save_meal_analysis(user_id, lang, parsed)
-    except SQLAlchemyError:
-        pass
-
-    return jsonify(parsed)
+    return json_response(finalize(parsed))
 
 
 @app.post("/api/recommendations")
@@ -1017,32 +1487,38 @@ def recommendations():
 
     payload = request.get_json(silent=True) or {}
 
-    try:
-        raw = invoke_ai(
-            [
-                {"role": "system", "content": SYSTEM_PROMPT_RECO},
-                {"role": "user", "content": json.dumps(payload, ensure_ascii=False)},
-            ],
-            temperature=0.4,
+    def finalize(parsed: dict) -> dict:
+        parsed.setdefault("schema_version", "1.0")
+        parsed["user_id"] = user_id
+        parsed["datetime_utc"] = utc_now_iso()
+        try:
+            save_recommendation(user_id, parsed)
+        except SQLAlchemyError:
+            pass
+        return parsed
+
+    if wants_event_stream():
+        # Streamed requests bypass micro-batching: one client owns the stream.
+        return stream_model_response(
+            lambda: build_recommendation_messages(payload), 0.4, finalize
         )
+
+    try:
+        parsed, raw = request_recommendation(payload)
     except Exception:
         # Keep the client-facing failure contract independent of the provider.
         return jsonify({"error": "model_request_failed"}), 502
-    parsed = safe_json_loads(raw)
     if parsed is None:
         return jsonify({"error": "model_returned_invalid_json", "raw": raw}), 502
 
-    parsed.setdefault("schema_version", "1.0")
-    parsed["user_id"] = user_id
-    parsed["datetime_utc"] = utc_now_iso()
-
-    try:
-        save_recommendation(user_id, parsed)
-    except SQLAlchemyError:
-        pass
-
-    return jsonify(parsed)
+    return json_response(finalize(parsed))
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=int(os.environ.get("PORT", "8086")), debug=True)
+    # Local development only; production runs under gunicorn (gunicorn.conf.py).
+    app.run(
+        host="0.0.0.0",
+        port=int(os.environ.get("PORT", "8086")),
+        debug=os.environ.get("FLASK_ENV") == "development",
+        threaded=True,
+    )
@@ -0,0 +1,27 @@
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+
+# Requests spend most of their time waiting on the AI provider, Google or the
+# mobile API, so concurrency comes from threads rather than extra processes.
+# Keep the process count small and fixed: cpu_count() reports the host's CPUs
+# inside containers, and every worker gets its own AI_MAX_CONCURRENCY budget.
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "64"))
+
+# Import the app once in the master, so initialize_database() (CREATE DATABASE /
+# create_all) runs a single time instead of racing in every worker.
+preload_app = True
+
+# Model calls may take up to 90s (see call_ai_provider).
+timeout = 120
+keepalive = 5
+
+
+def post_fork(server, worker):
+    # Workers must not reuse pooled connections inherited from the master.
+    from app import db_engine
+
+    if db_engine is not None:
+        db_engine.dispose(close=False)
@@ -1,5 +1,7 @@
 import os
+import time
 import unittest
+from datetime import datetime, timedelta, timezone
 from unittest.mock import Mock, patch
 
 from app import (
@@ -8,8 +10,13 @@ from app import (
     get_ai_provider,
     get_missing_env_vars,
     invoke_ai,
+    safe_json_loads,
+    stream_ai_provider,
+    utc_now_iso,
     verify_access_token,
+    verify_google_id_token,
 )
+import app as app_module
 
 
 class AiProviderTests(unittest.TestCase):
@@ -45,7 +52,7 @@ class AiProviderTests(unittest.TestCase):
         ):
             self.assertEqual(get_missing_env_vars(), [])
 
-    @patch("app.requests.post")
+    @patch("app._ai_http.post")
     def test_provider_request_enforces_json_without_changing_output(self, post):
         response = Mock()
         response.json.return_value = {
@@ -67,6 +74,43 @@ class AiProviderTests(unittest.TestCase):
         sent_payload = post.call_args.kwargs["json"]
         self.assertEqual(sent_payload["response_format"], {"type": "json_object"})
 
+    @patch("app._ai_http.post")
+    def test_streaming_provider_yields_content_deltas(self, post):
+        response = post.return_value.__enter__.return_value
+        response.iter_lines.return_value = [
+            b'data: {"choices":[{"delta":{"role":"assistant"}}]}',
+            b"",
+            b'data: {"choices":[{"delta":{"content":"{\\"ok\\""}}]}',
+            b'data: {"choices":[{"delta":{"content":":true}"}}]}',
+            b"data: [DONE]",
+        ]
+
+        deltas = list(
+            stream_ai_provider(
+                {"api_key": "secret", "model": "model", "base_url": "https://provider.example/chat"},
+                [{"role": "user", "content": "test"}],
+                0.2,
+            )
+        )
+
+        self.assertEqual("".join(deltas), '{"ok":true}')
+        self.assertTrue(post.call_args.kwargs["json"]["stream"])
+        self.assertTrue(post.call_args.kwargs["stream"])
+
+    def test_json_wrapped_in_markdown_fence_is_recovered(self):
+        self.assertEqual(safe_json_loads('```json\n{"ok": true}\n```'), {"ok": True})
+        self.assertEqual(safe_json_loads('```\n{"ok": true}```'), {"ok": True})
+        self.assertEqual(safe_json_loads('{"ok": true}'), {"ok": True})
+        self.assertIsNone(safe_json_loads("not json"))
+        self.assertIsNone(safe_json_loads(None))
+
+    def test_utc_timestamp_is_iso8601_with_z_suffix(self):
+        stamp = utc_now_iso()
+
+        self.assertRegex(stamp, r"^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\.\d{6}Z$")
+        parsed = datetime.fromisoformat(stamp.replace("Z", "+00:00"))
+        self.assertLess(abs(datetime.now(timezone.utc) - parsed), timedelta(seconds=5))
+
     @patch("app.call_ai_provider")
     def test_mistral_failure_falls_back_to_openai_transparently(self, call_provider):
         call_provider.side_effect = [RuntimeError("mistral unavailable"), '{"ok":true}']
@@ -86,6 +130,7 @@ class AiProviderTests(unittest.TestCase):
 
 class ApiCompatibilityTests(unittest.TestCase):
     def setUp(self):
+        app_module._meal_analysis_cache.clear()
         self.client = app.test_client()
 
     def test_missing_provider_preserves_legacy_error_payload(self):
@@ -136,6 +181,145 @@ class ApiCompatibilityTests(unittest.TestCase):
         self.assertIn("datetime_utc", body)
         self.assertEqual(body["meal"], {"items": [], "totals": {}})
 
+    @patch("app.save_meal_analysis")
+    @patch("app.invoke_ai", return_value='{"meal":{"items":[],"totals":{}}}')
+    @patch("app.verify_google_id_token", return_value={"sub": "user-123"})
+    def test_non_string_text_is_still_analyzed(self, verify_token, invoke_ai, save_meal):
+        with patch.dict(
+            os.environ,
+            {"MISTRAL_API_KEY": "mistral-key", "GOOGLE_CLIENT_ID": "client-id"},
+            clear=True,
+        ):
+            response = self.client.post(
+                "/api/analyze-meal",
+                json={"lang": "en", "text": ["2 eggs", "salad"]},
+                headers={"Authorization": "Bearer token"},
+            )
+
+        self.assertEqual(response.status_code, 200)
+        invoke_ai.assert_called_once()
+
+    @patch("app.save_meal_analysis")
+    @patch("app.invoke_ai", return_value='{"meal":{"items":[],"totals":{}}}')
+    @patch("app.verify_google_id_token")
+    def test_repeated_text_analysis_is_served_from_cache(
+        self, verify_token, invoke_ai, save_meal
+    ):
+        verify_token.side_effect = [{"sub": "user-1"}, {"sub": "user-2"}]
+
+        with patch.dict(
+            os.environ,
+            {"MISTRAL_API_KEY": "mistral-key", "GOOGLE_CLIENT_ID": "client-id"},
+            clear=True,
+        ):
+            first = self.client.post(
+                "/api/analyze-meal",
+                json={"lang": "fr", "text": "salad"},
+                headers={"Authorization": "Bearer token"},
+            )
+            second = self.client.post(
+                "/api/analyze-meal",
+                json={"lang": "fr", "text": "salad"},
+                headers={"Authorization": "Bearer token"},
+            )
+
+        self.assertEqual(invoke_ai.call_count, 1)
+        self.assertEqual(first.get_json()["user_id"], "user-1")
+        self.assertEqual(second.get_json()["user_id"], "user-2")
+        self.assertEqual(second.get_json()["meal"], {"items": [], "totals": {}})
+        self.assertEqual(save_meal.call_count, 2)
+
+    @patch("app.save_meal_analysis")
+    @patch("app.stream_ai", return_value=iter(['{"meal":', '{"items":[]}}']))
+    @patch("app.verify_google_id_token", return_value={"sub": "user-123"})
+    def test_analyze_meal_streams_server_sent_events_when_requested(
+        self, verify_token, stream_ai, save_meal
+    ):
+        with patch.dict(
+            os.environ,
+            {"MISTRAL_API_KEY": "mistral-key", "GOOGLE_CLIENT_ID": "client-id"},
+            clear=True,
+        ):
+            response = self.client.post(
+                "/api/analyze-meal",
+                json={"lang": "fr", "text": "salad"},
+                headers={"Authorization": "Bearer token", "Accept": "text/event-stream"},
+            )
+            body = response.get_data(as_text=True)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "text/event-stream")
+        self.assertIn('data: "{\\"meal\\":"\n\n', body)
+        self.assertIn("event: done\n", body)
+        self.assertIn('"user_id":"user-123"', body)
+        save_meal.assert_called_once()
+
+    @patch("app.save_recommendation")
+    @patch("app.stream_ai", return_value=iter(["[1,", "2]"]))
+    @patch("app.verify_google_id_token", return_value={"sub": "user-123"})
+    def test_streamed_non_object_json_is_an_error_event(
+        self, verify_token, stream_ai, save_recommendation
+    ):
+        with patch.dict(
+            os.environ,
+            {"MISTRAL_API_KEY": "mistral-key", "GOOGLE_CLIENT_ID": "client-id"},
+            clear=True,
+        ):
+            response = self.client.post(
+                "/api/recommendations",
+                json={"goal": "maintenance"},
+                headers={"Authorization": "Bearer token", "Accept": "text/event-stream"},
+            )
+            body = response.get_data(as_text=True)
+
+        self.assertTrue(
+            body.endswith('event: error\ndata: {"error":"model_returned_invalid_json","raw":"[1,2]"}\n\n')
+        )
+        save_recommendation.assert_not_called()
+
+    @patch("app.stream_ai")
+    @patch("app.build_recommendation_messages", side_effect=TypeError("unserializable"))
+    @patch("app.verify_google_id_token", return_value={"sub": "user-123"})
+    def test_streamed_recommendation_prompt_failure_is_an_error_event(
+        self, verify_token, build_messages, stream_ai
+    ):
+        with patch.dict(
+            os.environ,
+            {"MISTRAL_API_KEY": "mistral-key", "GOOGLE_CLIENT_ID": "client-id"},
+            clear=True,
+        ):
+            response = self.client.post(
+                "/api/recommendations",
+                json={"goal": "maintenance"},
+                headers={"Authorization": "Bearer token", "Accept": "text/event-stream"},
+            )
+            body = response.get_data(as_text=True)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, 'event: error\ndata: {"error":"model_request_failed"}\n\n')
+        stream_ai.assert_not_called()
+
+    @patch("app.save_recommendation")
+    @patch("app.invoke_ai", return_value='{"recommendations":[]}')
+    @patch("app.verify_google_id_token", return_value={"sub": "user-123"})
+    def test_recommendations_accept_integers_beyond_64_bits(
+        self, verify_token, invoke_ai, save_recommendation
+    ):
+        with patch.dict(
+            os.environ,
+            {"MISTRAL_API_KEY": "mistral-key", "GOOGLE_CLIENT_ID": "client-id"},
+            clear=True,
+        ):
+            response = self.client.post(
+                "/api/recommendations",
+                data='{"history":[{"calories":123456789012345678901234567890}]}',
+                content_type="application/json",
+                headers={"Authorization": "Bearer token"},
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("123456789012345678901234567890", invoke_ai.call_args.args[0][1]["content"])
+
     @patch("app.invoke_ai", side_effect=RuntimeError("provider-specific secret"))
     @patch("app.verify_google_id_token", return_value={"sub": "user-123"})
     def test_provider_failure_does_not_leak_provider_details(
@@ -172,6 +356,14 @@ class ApiCompatibilityTests(unittest.TestCase):
         self.assertEqual(response.get_json()["user"]["id"], "user-123")
         self.assertEqual(response.get_json()["user"]["auth_provider"], "google")
 
+    def test_openapi_spec_is_served_as_cacheable_json(self):
+        response = self.client.get("/api/openapi.json")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/json")
+        self.assertIn("max-age", response.headers["Cache-Control"])
+        self.assertIn("/api/analyze-meal", response.get_json()["paths"])
+
     def test_current_user_requires_bearer_token(self):
         response = self.client.get("/api/me")
 
@@ -206,6 +398,34 @@ class MobileAuthenticationTests(unittest.TestCase):
         )
 
 
+class GoogleTokenCacheTests(unittest.TestCase):
+    def setUp(self):
+        app_module._google_token_cache.clear()
+
+    @patch("google.oauth2.id_token.verify_oauth2_token")
+    def test_repeated_token_is_verified_once(self, verify):
+        verify.return_value = {"sub": "user-123", "exp": time.time() + 3600}
+
+        with patch.dict(os.environ, {"GOOGLE_CLIENT_ID": "client-id"}, clear=True):
+            first = verify_google_id_token("token")
+            second = verify_google_id_token("token")
+
+        self.assertEqual(first["sub"], "user-123")
+        self.assertEqual(second["sub"], "user-123")
+        self.assertEqual(verify.call_count, 1)
+        self.assertNotIn("token", app_module._google_token_cache)
+
+    @patch("google.oauth2.id_token.verify_oauth2_token")
+    def test_expiring_token_is_verified_again(self, verify):
+        verify.return_value = {"sub": "user-123", "exp": time.time() + 1}
+
+        with patch.dict(os.environ, {"GOOGLE_CLIENT_ID": "client-id"}, clear=True):
+            verify_google_id_token("token")
+            verify_google_id_token("token")
+
+        self.assertEqual(verify.call_count, 2)
+
+
 class SharedMobileAccountTests(unittest.TestCase):
     def setUp(self):
         app.config.update(
@@ -258,19 +478,20 @@ class SharedMobileAccountTests(unittest.TestCase):
 
     @patch("app.mobile_api_request")
     def test_dashboard_combines_mobile_meals_goals_water_and_points(self, mobile_request):
-        payloads = [
-            [{"id": "meal-1", "total_calories": 540}],
-            {"calories_target": 2100, "protein_g_target": 125, "carbs_g_target": 230},
-            {"liters": 1.5},
-            {"balance": 80},
-        ]
-        responses = []
-        for payload in payloads:
+        payloads = {
+            "/meals": [{"id": "meal-1", "total_calories": 540}],
+            "/goals": {"calories_target": 2100, "protein_g_target": 125, "carbs_g_target": 230},
+            "/water-intake": {"liters": 1.5},
+            "/points/wallet": {"balance": 80},
+        }
+
+        def respond(method, path, **kwargs):
             response = Mock(status_code=200)
-            response.json.return_value = payload
+            response.json.return_value = payloads[path]
             response.raise_for_status.return_value = None
-            responses.append(response)
-        mobile_request.side_effect = responses
+            return response
+
+        mobile_request.side_effect = respond
 
         with self.client.session_transaction() as browser_session:
             browser_session["mobile_user_id"] = "9c964d41-ff1a-4b51-960a-2341bddf18ec"
@@ -284,6 +505,7 @@ class SharedMobileAccountTests(unittest.TestCase):
         self.assertEqual(body["goals"]["calories_target"], 2100)
         self.assertEqual(body["water"]["liters"], 1.5)
         self.assertEqual(body["points"]["balance"], 80)
+        self.assertEqual(mobile_request.call_count, 4)
 
 
 if __name__ == "__main__":
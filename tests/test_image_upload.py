@@ -0,0 +1,239 @@
+import base64
+import hashlib
+import io
+import os
+import unittest
+from unittest.mock import patch
+
+from PIL import Image
+
+import app as app_module
+from app import IMAGE_MAX_DECODE_PIXELS, IMAGE_MAX_SIDE, MAX_IMAGE_BYTES, app, encode_image_data_url, maybe_downscale_image
+
+
+class ImageEncodingTests(unittest.TestCase):
+    def test_stream_encoding_matches_stdlib_for_any_length(self):
+        for size in (0, 1, 2, 3, 57 * 1024, 57 * 1024 + 1, 200_003):
+            data = os.urandom(size)
+
+            self.assertEqual(
+                encode_image_data_url(io.BytesIO(data), "image/png"),
+                "data:image/png;base64," + base64.b64encode(data).decode("ascii"),
+            )
+
+    def test_hash_is_computed_in_the_same_pass(self):
+        data = os.urandom(200_003)
+        hasher = hashlib.blake2b(digest_size=16)
+
+        encode_image_data_url(io.BytesIO(data), "image/jpeg", hasher)
+
+        self.assertEqual(hasher.digest(), hashlib.blake2b(data, digest_size=16).digest())
+
+
+class ImageDownscaleTests(unittest.TestCase):
+    def _png(self, width, height):
+        buffer = io.BytesIO()
+        Image.effect_noise((width, height), 64).convert("RGB").save(buffer, format="PNG")
+        buffer.seek(0)
+        return buffer
+
+    def test_small_image_is_passed_through(self):
+        stream = self._png(64, 48)
+
+        result, mime = maybe_downscale_image(stream, "image/png")
+
+        self.assertIs(result, stream)
+        self.assertEqual(mime, "image/png")
+        self.assertEqual(result.tell(), 0)
+
+    def test_oversized_image_is_reencoded_as_smaller_jpeg(self):
+        stream = self._png(2400, 1200)
+        original_size = len(stream.getvalue())
+
+        result, mime = maybe_downscale_image(stream, "image/png")
+
+        self.assertEqual(mime, "image/jpeg")
+        data = result.read()
+        self.assertLess(len(data), original_size)
+        with Image.open(io.BytesIO(data)) as image:
+            self.assertEqual(image.size, (IMAGE_MAX_SIDE, IMAGE_MAX_SIDE // 2))
+
+    def test_exif_orientation_is_applied_after_downscaling(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6  # rotate 90° clockwise on display
+        stream = io.BytesIO()
+        Image.effect_noise((3000, 1000), 64).convert("RGB").save(stream, format="JPEG", exif=exif)
+        stream.seek(0)
+
+        result, mime = maybe_downscale_image(stream, "image/jpeg")
+
+        self.assertEqual(mime, "image/jpeg")
+        with Image.open(result) as image:
+            self.assertEqual(image.size, (IMAGE_MAX_SIDE // 3, IMAGE_MAX_SIDE))
+
+    def test_huge_dimension_image_is_passed_through_without_decoding(self):
+        stream = io.BytesIO()
+        Image.new("1", (8000, 6000)).save(stream, format="PNG")
+        stream.seek(0)
+        self.assertGreater(8000 * 6000, IMAGE_MAX_DECODE_PIXELS)
+        self.assertLess(len(stream.getvalue()), MAX_IMAGE_BYTES)
+
+        with patch.object(Image.Image, "load") as load:
+            result, mime = maybe_downscale_image(stream, "image/png")
+
+        load.assert_not_called()
+        self.assertIs(result, stream)
+        self.assertEqual(mime, "image/png")
+        self.assertEqual(result.tell(), 0)
+
+    def test_undecodable_image_is_passed_through(self):
+        stream = io.BytesIO(b"not an image" * 100_000)
+
+        result, mime = maybe_downscale_image(stream, "image/jpeg")
+
+        self.assertIs(result, stream)
+        self.assertEqual(mime, "image/jpeg")
+
+
+class AnalyzeMealImageTests(unittest.TestCase):
+    def setUp(self):
+        app_module._meal_analysis_cache.clear()
+        self.client = app.test_client()
+
+    @patch("app.save_meal_analysis")
+    @patch("app.invoke_ai", return_value='{"meal":{"items":[],"totals":{}}}')
+    @patch("app.verify_google_id_token", return_value={"sub": "user-123"})
+    def test_repeated_image_analysis_is_served_from_cache(self, verify_token, invoke_ai, save_meal):
+        def post(image):
+            return self.client.post(
+                "/api/analyze-meal",
+                data={"lang": "fr", "image": (io.BytesIO(image), "meal.jpg", "image/jpeg")},
+                headers={"Authorization": "Bearer token"},
+            )
+
+        with patch.dict(
+            os.environ,
+            {"MISTRAL_API_KEY": "mistral-key", "GOOGLE_CLIENT_ID": "client-id"},
+            clear=True,
+        ):
+            first = post(b"\xff\xd8photo-a")
+            second = post(b"\xff\xd8photo-a")
+            third = post(b"\xff\xd8photo-b")
+
+        self.assertEqual([first.status_code, second.status_code, third.status_code], [200, 200, 200])
+        self.assertEqual(invoke_ai.call_count, 2)
+
+    @patch("app.save_meal_analysis")
+    @patch("app.invoke_ai", return_value='{"meal":{"items":[],"totals":{}}}')
+    @patch("app.verify_google_id_token", return_value={"sub": "user-123"})
+    def test_image_is_sent_as_data_url(self, verify_token, invoke_ai, save_meal):
+        image = b"\xff\xd8\xff\xe0fake-jpeg"
+
+        with patch.dict(
+            os.environ,
+            {"MISTRAL_API_KEY": "mistral-key", "GOOGLE_CLIENT_ID": "client-id"},
+            clear=True,
+        ):
+            response = self.client.post(
+                "/api/analyze-meal",
+                data={"lang": "fr", "image": (io.BytesIO(image), "meal.jpg", "image/jpeg")},
+                headers={"Authorization": "Bearer token"},
+            )
+
+        self.assertEqual(response.status_code, 200)
+        user_content = invoke_ai.call_args.args[0][1]["content"]
+        self.assertEqual(
+            user_content[1]["image_url"]["url"],
+            "data:image/jpeg;base64," + base64.b64encode(image).decode("ascii"),
+        )
+
+    @patch("app.save_meal_analysis")
+    @patch("app.invoke_ai", return_value='{"meal":{"items":[],"totals":{}}}')
+    @patch("app.verify_google_id_token", return_value={"sub": "user-123"})
+    def test_mime_type_is_inferred_from_filename(self, verify_token, invoke_ai, save_meal):
+        with patch.dict(
+            os.environ,
+            {"MISTRAL_API_KEY": "mistral-key", "GOOGLE_CLIENT_ID": "client-id"},
+            clear=True,
+        ):
+            response = self.client.post(
+                "/api/analyze-meal",
+                data={"image": (io.BytesIO(b"RIFF----WEBP"), "meal.webp", "application/octet-stream")},
+                headers={"Authorization": "Bearer token"},
+            )
+
+        self.assertEqual(response.status_code, 200)
+        url = invoke_ai.call_args.args[0][1]["content"][1]["image_url"]["url"]
+        self.assertTrue(url.startswith("data:image/webp;base64,"))
+
+    @patch("app.invoke_ai")
+    @patch("app.verify_google_id_token", return_value={"sub": "user-123"})
+    def test_unsupported_upload_types_are_rejected(self, verify_token, invoke_ai):
+        uploads = [
+            (b"%PDF-1.7", "menu.pdf", "application/pdf"),
+            (b"GIF89a", "meal.gif", "image/gif"),
+        ]
+        for content, filename, mimetype in uploads:
+            with self.subTest(filename=filename), patch.dict(
+                os.environ,
+                {"MISTRAL_API_KEY": "mistral-key", "GOOGLE_CLIENT_ID": "client-id"},
+                clear=True,
+            ):
+                response = self.client.post(
+                    "/api/analyze-meal",
+                    data={"image": (io.BytesIO(content), filename, mimetype)},
+                    headers={"Authorization": "Bearer token"},
+                )
+
+                self.assertEqual(response.status_code, 415)
+                self.assertEqual(response.get_json(), {"error": "unsupported_media_type"})
+        invoke_ai.assert_not_called()
+
+    @patch("app.invoke_ai")
+    @patch("app.verify_google_id_token", return_value={"sub": "user-123"})
+    def test_oversized_image_is_rejected_before_encoding(self, verify_token, invoke_ai):
+        with patch.dict(
+            os.environ,
+            {"MISTRAL_API_KEY": "mistral-key", "GOOGLE_CLIENT_ID": "client-id"},
+            clear=True,
+        ), patch("app.encode_image_data_url") as encode:
+            response = self.client.post(
+                "/api/analyze-meal",
+                data={"image": (io.BytesIO(b"\0" * (MAX_IMAGE_BYTES + 1)), "meal.jpg", "image/jpeg")},
+                headers={"Authorization": "Bearer token"},
+            )
+
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(response.get_json(), {"error": "image_too_large"})
+        encode.assert_not_called()
+        invoke_ai.assert_not_called()
+
+    @patch("app.invoke_ai")
+    @patch("app.verify_google_id_token", return_value={"sub": "user-123"})
+    def test_forged_part_content_length_does_not_bypass_size_limit(self, verify_token, invoke_ai):
+        boundary = "meal-boundary"
+        body = (
+            f"--{boundary}\r\n"
+            'Content-Disposition: form-data; name="image"; filename="meal.jpg"\r\n'
+            "Content-Type: image/jpeg\r\n"
+            "Content-Length: 10\r\n\r\n"
+        ).encode("ascii") + b"\0" * (MAX_IMAGE_BYTES + 1) + f"\r\n--{boundary}--\r\n".encode("ascii")
+
+        with patch.dict(
+            os.environ,
+            {"MISTRAL_API_KEY": "mistral-key", "GOOGLE_CLIENT_ID": "client-id"},
+            clear=True,
+        ):
+            response = self.client.post(
+                "/api/analyze-meal",
+                data=body,
+                content_type=f"multipart/form-data; boundary={boundary}",
+                headers={"Authorization": "Bearer token"},
+            )
+
+        self.assertEqual(response.status_code, 413)
+        invoke_ai.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+from unittest.mock import patch
+
+from app import RecommendationBatcher, generate_recommendation_batch
+
+
+class RecommendationBatchTests(unittest.TestCase):
+    @patch("app.invoke_ai")
+    def test_batch_is_answered_by_one_model_call(self, invoke_ai):
+        invoke_ai.return_value = '{"results":[{"warnings":["a"]},{"warnings":["b"]}]}'
+
+        results = generate_recommendation_batch([{"goal": "a"}, {"goal": "b"}])
+
+        self.assertEqual(invoke_ai.call_count, 1)
+        self.assertEqual([parsed["warnings"] for parsed, _ in results], [["a"], ["b"]])
+        self.assertIn('"requests"', invoke_ai.call_args.args[0][1]["content"])
+
+    @patch("app.invoke_ai")
+    def test_unmatched_batch_results_are_split_and_retried(self, invoke_ai):
+        invoke_ai.side_effect = [
+            '{"results":[{"warnings":["only one"]}]}',
+            '{"warnings":["a"]}',
+            '{"warnings":["b"]}',
+        ]
+
+        results = generate_recommendation_batch([{"goal": "a"}, {"goal": "b"}])
+
+        self.assertEqual(invoke_ai.call_count, 3)
+        self.assertEqual([parsed["warnings"] for parsed, _ in results], [["a"], ["b"]])
+
+    @patch("app.invoke_ai")
+    def test_batcher_coalesces_requests_within_window(self, invoke_ai):
+        invoke_ai.return_value = '{"results":[{"warnings":["a"]},{"warnings":["b"]}]}'
+        batcher = RecommendationBatcher(window_seconds=0.5, max_size=2)
+
+        first = batcher.submit({"goal": "a"})
+        second = batcher.submit({"goal": "b"})
+
+        self.assertEqual(first.result(timeout=5)[0]["warnings"], ["a"])
+        self.assertEqual(second.result(timeout=5)[0]["warnings"], ["b"])
+        self.assertEqual(invoke_ai.call_count, 1)
+
+    @patch("app.invoke_ai", side_effect=RuntimeError("provider down"))
+    def test_batcher_propagates_provider_failure_to_every_caller(self, invoke_ai):
+        batcher = RecommendationBatcher(window_seconds=0.05, max_size=8)
+
+        future = batcher.submit({"goal": "a"})
+
+        with self.assertRaises(RuntimeError):
+            future.result(timeout=5)
+
+
+if __name__ == "__main__":
+    unittest.main()